@@ -0,0 +1,239 @@
+####################################################################
+# IMPORTS
+####################################################################
+import logging
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+import sys
+from time import sleep, monotonic
+import numpy as np
+
+####################################################################
+# BACKEND REGISTRY
+####################################################################
+
+# Each layer maps a backend name to a factory
+# Hardware packages are imported inside the factories, so they are only loaded when a backend is first created
+# The 'DAQ Backend' choices are read when TDSProcedure is defined, so DAQ backends must be registered before
+# TDSProcedure is imported (i.e. in this file, or in a script that imports Backends first)
+# The motion and dialog backends used are set by DEFAULT_MOTION and DEFAULT_DIALOG, which are read each time
+# a backend is created and can be changed after import
+# Factory signatures:
+#	motion: factory(ip) -> XPS-like stage controller
+#	daq:    factory(procedure) -> object with Read() returning lockin (X, Y) in mV, ReadSamples(n) returning
+#	        'n' consecutive X and Y samples as arrays in mV, plus 'sensitivity' (mV), 'timeConstant' (s, None if unknown),
+#	        'readTime' (s per Read), 'sampleTime' (s between ReadSamples samples) and 'maxSamples' (most samples per
+#	        ReadSamples call, None if unlimited) attributes, and Close() to release the hardware
+#	dialog: factory() -> save path chosen by the user ('' if none)
+BACKENDS = {'motion': {}, 'daq': {}, 'dialog': {}}
+
+def RegisterBackend(layer, name, factory):
+	if layer not in BACKENDS:
+		raise ValueError("Unknown backend layer '{}'".format(layer))
+
+	BACKENDS[layer][name] = factory
+
+def GetBackendNames(layer):
+	return list(BACKENDS[layer].keys())
+
+def CreateBackend(layer, name, *args, **kwargs):
+	try:
+		factory = BACKENDS[layer][name]
+	except KeyError:
+		raise ValueError("Unknown {} backend '{}' (available: {})".format(layer, name, ", ".join(BACKENDS.get(layer, {}))))
+
+	log.info("Creating {} backend '{}'".format(layer, name))
+
+	return factory(*args, **kwargs)
+
+####################################################################
+# MOTION BACKENDS
+####################################################################
+
+def NewportXPSMotion(ip):
+	import XPSHelper as xpsHelp
+
+	return xpsHelp.InitXPS(ip)
+
+####################################################################
+# DAQ BACKENDS
+####################################################################
+
+class MCCDAQ:
+	# Reads the lockin X/Y analog outputs with an MCC DAC
+	def __init__(self, procedure):
+		from mcculw import ul
+		from mcculw.enums import ULRange
+
+		self.ul = ul
+		self.board = procedure.mccdacBoard
+		self.xChannel = procedure.mccdacXChannel
+		self.yChannel = procedure.mccdacYChannel
+		self.dacRange = ULRange.BIP10VOLTS
+
+		# Lockin settings can't be read over the analog outputs, so they come from the procedure
+		self.sensitivity = procedure.lockinSen
+		self.timeConstant = None
+		self.readTime = 0
+
+		# Samples are spaced by a lockin time constant
+		self.sampleTime = procedure.dacWait
+		self.maxSamples = None
+
+	def ReadVoltage(self, channel):
+		return self.ul.to_eng_units(self.board, self.dacRange, self.ul.a_in(self.board, channel, self.dacRange))
+
+	def Read(self):
+		# Lockin outputs are 10 V at full scale, convert to lockin mV
+		x = self.sensitivity * self.ReadVoltage(self.xChannel) / 10
+		y = self.sensitivity * self.ReadVoltage(self.yChannel) / 10
+
+		return x, y
+
+	def ReadSamples(self, n):
+		x = np.empty(n)
+		y = np.empty(n)
+
+		for i in range(n):
+			if i > 0:
+				sleep(self.sampleTime)
+
+			x[i], y[i] = self.Read()
+
+		return x, y
+
+	def Close(self):
+		# mcculw has no connection to close
+		pass
+
+class SR830Buffer:
+	# Reads lockin X/Y digitally from the SR830 internal buffer
+	# Many points are pulled per request using the binary (TRCB) transfer, and the
+	# sensitivity and time constant are read back from the lockin
+	SAMPLE_RATES = [2.0 ** (i - 4) for i in range(14)] # Hz, list index is the SRAT setting
+	MAX_BUFFER_POINTS = 16383
+
+	def __init__(self, procedure):
+		from pymeasure.instruments.srs import SR830
+
+		if procedure.lockinSampleRate <= 0:
+			raise ValueError("Lockin sample rate must be positive (got {} Hz)".format(procedure.lockinSampleRate))
+
+		self.lockin = SR830(procedure.lockinResource)
+		self.shouldStop = procedure.should_stop
+
+		# Store the settings changed below so they can be restored by 'Close'
+		self.savedSettings = ["DDEF 1,{}".format(self.lockin.ask("DDEF? 1").strip()), "DDEF 2,{}".format(self.lockin.ask("DDEF? 2").strip()), "SRAT {}".format(self.lockin.ask("SRAT?").strip()), "SEND {}".format(self.lockin.ask("SEND?").strip())]
+
+		# Use the closest sample rate the lockin supports
+		self.rateIndex = min(range(len(self.SAMPLE_RATES)), key=lambda i: abs(np.log2(self.SAMPLE_RATES[i] / procedure.lockinSampleRate)))
+		self.sampleRate = self.SAMPLE_RATES[self.rateIndex]
+		self.bufferPoints = max(1, min(procedure.lockinBufferPoints, self.MAX_BUFFER_POINTS))
+
+		# The buffers store the displayed values, so display X on CH1 and Y on CH2
+		self.lockin.write("DDEF 1,0,0")
+		self.lockin.write("DDEF 2,0,0")
+
+		# Set sample rate and stop filling the buffer once it is full
+		self.lockin.write("SRAT {}".format(self.rateIndex))
+		self.lockin.write("SEND 0")
+
+		# Read back lockin settings
+		self.sensitivity = self.lockin.sensitivity * 1000 # V -> mV
+		self.timeConstant = self.lockin.time_constant
+		self.readTime = self.bufferPoints / self.sampleRate
+		self.sampleTime = 1 / self.sampleRate
+		self.maxSamples = self.MAX_BUFFER_POINTS
+
+		log.info("SR830: sensitivity = {} mV, time constant = {} s, {} points at {} Hz".format(self.sensitivity, self.timeConstant, self.bufferPoints, self.sampleRate))
+
+	def ReadBuffer(self, channel, n):
+		# TRCB transfers the buffer as 4 byte little-endian IEEE floats
+		self.lockin.write("TRCB? {},0,{}".format(channel, n))
+
+		return np.frombuffer(self.lockin.read_bytes(4 * n), dtype='<f4').astype(float)
+
+	def ReadSamples(self, n):
+		# Fill the buffer with 'n' points and return the X and Y arrays in mV
+		# If the procedure is stopped while filling, only the points stored so far are returned
+		if n > self.MAX_BUFFER_POINTS:
+			raise ValueError("Can't read {} points, the lockin buffer holds {}".format(n, self.MAX_BUFFER_POINTS))
+
+		fillTime = n / self.sampleRate
+
+		# Allow twice the fill time (plus some for communication) before giving up
+		timeout = monotonic() + 2 * fillTime + 0.5
+
+		self.lockin.write("REST")
+		self.lockin.write("STRT")
+
+		sleep(fillTime)
+
+		# Wait for the buffer to finish filling
+		while True:
+			stored = int(self.lockin.ask("SPTS?"))
+
+			if stored >= n:
+				break
+
+			if self.shouldStop():
+				n = stored
+				break
+
+			if monotonic() > timeout:
+				self.lockin.write("PAUS")
+				raise TimeoutError("Lockin buffer only filled {} of {} points".format(stored, n))
+
+			sleep(1 / self.sampleRate)
+
+		self.lockin.write("PAUS")
+
+		if n == 0:
+			return np.empty(0), np.empty(0)
+
+		x = self.ReadBuffer(1, n) * 1000 # V -> mV
+		y = self.ReadBuffer(2, n) * 1000 # V -> mV
+
+		return x, y
+
+	def Read(self):
+		x, y = self.ReadSamples(self.bufferPoints)
+
+		return np.mean(x), np.mean(y)
+
+	def Close(self):
+		# Restore the lockin settings and release the connection
+		for command in self.savedSettings:
+			self.lockin.write(command)
+
+		self.lockin.adapter.close()
+
+####################################################################
+# DIALOG BACKENDS
+####################################################################
+
+def Win32SaveDialog():
+	import win32ui
+
+	dlg = win32ui.CreateFileDialog( 1, ".dat", "", 0, "Data Files (*.dat)|*.dat|All Files (*.*)|*.*|")
+	dlg.DoModal()
+	return dlg.GetPathName()
+
+def NoSaveDialog():
+	# Headless runs cannot ask for a path, so the data is not saved
+	log.warning("No save dialog available, use 'Auto Name File' to save data")
+	return ''
+
+####################################################################
+# DEFAULT BACKENDS
+####################################################################
+
+RegisterBackend('motion', 'Newport XPS', NewportXPSMotion)
+RegisterBackend('daq', 'MCCDAQ', MCCDAQ)
+RegisterBackend('daq', 'SR830 Buffer', SR830Buffer)
+RegisterBackend('dialog', 'win32', Win32SaveDialog)
+RegisterBackend('dialog', 'none', NoSaveDialog)
+
+DEFAULT_MOTION = 'Newport XPS'
+DEFAULT_DIALOG = 'win32' if sys.platform == 'win32' else 'none'
@@ -0,0 +1,42 @@
+####################################################################
+# IMPORTS
+####################################################################
+import os
+import subprocess
+import sys
+
+####################################################################
+# IMPORT-TIME BENCHMARK
+####################################################################
+
+# Modules to time, from the lightest (analysis/headless) to the full GUI
+MODULES = ['XPSHelper', 'TDSAnalysis', 'Backends', 'TDSProcedure', 'TDSpy']
+
+def TimeImport(module, repeats = 5):
+	# Each import is timed in a fresh interpreter so nothing is cached between runs
+	# Returns the best time in seconds and None, or None and the error line if the import failed
+	repoDir = os.path.dirname(os.path.abspath(__file__))
+	code = "import time; t = time.perf_counter(); import {}; print(time.perf_counter() - t)".format(module)
+
+	times = []
+
+	for i in range(repeats):
+		proc = subprocess.run([sys.executable, "-c", code], cwd=repoDir, capture_output=True, text=True)
+
+		if proc.returncode != 0:
+			# Last line of the traceback is the exception
+			errLines = proc.stderr.strip().splitlines()
+			return None, errLines[-1] if errLines else "exit code {}".format(proc.returncode)
+
+		times.append(float(proc.stdout.strip().splitlines()[-1]))
+
+	return min(times), None
+
+if __name__ == "__main__":
+	for module in MODULES:
+		importTime, err = TimeImport(module)
+
+		if importTime is None:
+			print("{:<15} import failed: {}".format(module, err))
+		else:
+			print("{:<15} {:8.1f} ms".format(module, importTime * 1000))
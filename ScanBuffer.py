@@ -0,0 +1,74 @@
+####################################################################
+# IMPORTS
+####################################################################
+import numpy as np
+
+####################################################################
+# GENERAL FUNCTIONS
+####################################################################
+
+def FormatColumn(values, integer = False):
+	# Formats a column of values as strings in one go
+	# Unmeasured values are written as 'NaN', counts as integers
+	nan = np.isnan(values)
+	strings = np.full(len(values), "NaN", dtype=object)
+
+	measured = values[~nan]
+
+	if integer:
+		measured = measured.astype(np.int64)
+
+	strings[~nan] = list(map(str, measured.tolist()))
+
+	return strings
+
+####################################################################
+# SCAN BUFFER
+####################################################################
+
+class ScanBuffer:
+	# Preallocated store for scan data, one structured NumPy row per point
+	# Columns are returned as views of the filled rows (no copies), so they can be passed straight to the FFT, plots and saving
+	# All columns are floats so unfilled values can be NaN
+	COLUMNS = ['Delay', 'X', 'Y', 'SigMon', 'Freq', 'FFT', 'XErr', 'YErr', 'Samples']
+
+	def __init__(self, size):
+		self.array = np.full(max(1, int(size)), np.nan, dtype=[(column, float) for column in self.COLUMNS])
+		self.count = 0
+
+	def __len__(self):
+		return self.count
+
+	def __getitem__(self, column):
+		# View of the column for the filled rows
+		return self.array[column][:self.count]
+
+	def __setitem__(self, column, values):
+		# Fill a whole column (e.g. the FFT once the scan is done)
+		self.array[column][:len(values)] = values
+
+	def Grow(self):
+		# Double the size, only needed when the number of points isn't known in advance
+		newArray = np.full(len(self.array) * 2, np.nan, dtype=self.array.dtype)
+		newArray[:self.count] = self.array[:self.count]
+		self.array = newArray
+
+	def Append(self, values):
+		# Fill the next row from a dictionary of column values, missing columns are left as NaN
+		if self.count >= len(self.array):
+			self.Grow()
+
+		for column in values:
+			self.array[column][self.count] = values[column]
+
+		self.count += 1
+
+	def Write(self, datFile, columns, intColumns = (), chunkRows = 100000):
+		# Write the filled rows of the given columns as tab separated text
+		# Columns are formatted a chunk of rows at a time to limit the memory used by the strings
+		for start in range(0, self.count, chunkRows):
+			stop = min(start + chunkRows, self.count)
+
+			strColumns = [FormatColumn(self.array[column][start:stop], column in intColumns) for column in columns]
+
+			datFile.write("\n".join(map("\t".join, zip(*strColumns))) + "\n")
@@ -0,0 +1,148 @@
+####################################################################
+# IMPORTS
+####################################################################
+import numpy as np
+
+####################################################################
+# FFT FUNCTIONS
+####################################################################
+
+def GetFFTAbs(x, y):
+	# scipy.fft is imported here as it is slow to import and only needed once a scan has finished
+	from scipy.fft import fft, fftfreq
+
+	N = len(x)
+
+	fftFull = fft(y)
+	freq = fftfreq(N, x[1]-x[0])
+	fftAbs = 2.0/N * np.abs(fftFull)
+
+	return freq, fftAbs
+
+####################################################################
+# ALIGNMENT FUNCTIONS
+####################################################################
+
+def GetTraceShifts(traces, reference = None, maxShift = None):
+	# Gets the sub-sample shift of each trace (row of 'traces') relative to 'reference' (mean trace if None)
+	# Shifts are in samples, positive means the trace is later than the reference
+	# 'maxShift' limits the shift to +-maxShift samples (e.g. to avoid locking onto an echo)
+	from scipy.fft import rfft, irfft, next_fast_len
+
+	traces = np.atleast_2d(np.asarray(traces, dtype=float))
+	N = traces.shape[1]
+
+	if reference is None:
+		reference = traces.mean(axis=0)
+
+	reference = np.asarray(reference, dtype=float)
+
+	# Zero pad so the correlation doesn't wrap around
+	nPad = next_fast_len(2 * N - 1, real=True)
+
+	# Cross-correlate every trace with the reference in one go (offsets removed so they don't bias the peak)
+	tracesFFT = rfft(traces - traces.mean(axis=1, keepdims=True), nPad, axis=1, workers=-1)
+	refFFT = rfft(reference - reference.mean(), nPad)
+	xcorr = irfft(tracesFFT * np.conj(refFFT), nPad, axis=1, workers=-1)
+
+	# Lag of each correlation index
+	lags = np.arange(nPad)
+	lags[lags > nPad // 2] -= nPad
+
+	if maxShift is None:
+		peak = np.argmax(xcorr, axis=1)
+	else:
+		peak = np.argmax(np.where(np.abs(lags) <= maxShift, xcorr, -np.inf), axis=1)
+
+	# Parabolic interpolation around the peak for the sub-sample part of the shift
+	rows = np.arange(len(peak))
+	yPrev = xcorr[rows, (peak - 1) % nPad]
+	yPeak = xcorr[rows, peak]
+	yNext = xcorr[rows, (peak + 1) % nPad]
+
+	# Only interpolate true local maxima, a peak on the edge of the window isn't one
+	interp = (yPeak >= yPrev) & (yPeak >= yNext)
+
+	if maxShift is not None:
+		interp &= np.abs(lags[peak]) + 1 <= maxShift
+
+	denom = yPrev - 2 * yPeak + yNext
+	frac = np.zeros(len(peak))
+	np.divide(0.5 * (yPrev - yNext), denom, out=frac, where=interp & (denom != 0))
+
+	shifts = lags[peak] + np.clip(frac, -0.5, 0.5)
+
+	if maxShift is not None:
+		shifts = np.clip(shifts, -maxShift, maxShift)
+
+	return shifts
+
+def ShiftTraces(traces, shifts):
+	# Shifts each trace (row of 'traces') earlier by its shift in samples using an FFT phase ramp
+	# i.e. shifted[n] = trace[n + shift], so the shifts from 'GetTraceShifts' line the traces up with the reference
+	from scipy.fft import rfft, irfft, rfftfreq, next_fast_len
+
+	traces = np.atleast_2d(np.asarray(traces, dtype=float))
+	shifts = np.asarray(shifts, dtype=float)
+	M, N = traces.shape
+
+	# Pad with the end values (last value then first value) so samples shifted in past the ends don't
+	# cause a step, and the wrap around from the phase ramp stays in the padding
+	nPad = next_fast_len(2 * N, real=True)
+	half = N + (nPad - N) // 2
+
+	padded = np.empty((M, nPad))
+	padded[:, :N] = traces
+	padded[:, N:half] = traces[:, -1:]
+	padded[:, half:] = traces[:, :1]
+
+	freq = rfftfreq(nPad) # cycles/sample
+	paddedFFT = rfft(padded, axis=1, workers=-1)
+	paddedFFT *= np.exp(2j * np.pi * freq[np.newaxis, :] * shifts[:, np.newaxis])
+
+	return irfft(paddedFFT, nPad, axis=1, workers=-1)[:, :N]
+
+def AlignTraces(traces, reference = None, maxShift = None):
+	# Aligns a stack of traces to the reference, returns the aligned traces and their shifts (samples)
+	shifts = GetTraceShifts(traces, reference, maxShift)
+
+	return ShiftTraces(traces, shifts), shifts
+
+def AlignAndAverage(traces, reference = None, maxShift = None):
+	# Aligns a stack of traces to the reference and averages them, returns the average and the shifts (samples)
+	aligned, shifts = AlignTraces(traces, reference, maxShift)
+
+	return aligned.mean(axis=0), shifts
+
+####################################################################
+# FILE FUNCTIONS
+####################################################################
+
+def ReadJoshFile(filepath, headerLines = 2):
+	# Reads a 'Josh' format scan file into a dictionary of arrays (keyed by the file headers)
+	with open(filepath, mode='r') as datFile:
+		headers = datFile.readline().rstrip('\n').split('\t')
+
+	data = np.genfromtxt(filepath, delimiter='\t', skip_header=headerLines, ndmin=2)
+
+	return {header: data[:, i] for i, header in enumerate(headers)}
+
+def AlignJoshFiles(filepaths, maxShift = None):
+	# Aligns and averages the X/Y traces of repeat scans saved as 'Josh' files (all with the same delay points)
+	# The X traces are aligned to the first file and the same shifts are applied to Y
+	# 'maxShift' (ps) limits the shift
+	# Returns the delay, averaged X, averaged Y and the shifts (ps)
+	scans = [ReadJoshFile(filepath) for filepath in filepaths]
+
+	delay = scans[0]['Delay']
+	step = delay[1] - delay[0]
+	xTraces = np.array([scan['X'] for scan in scans])
+	yTraces = np.array([scan['Y'] for scan in scans])
+
+	if maxShift is not None:
+		maxShift = maxShift / step
+
+	xAligned, shifts = AlignTraces(xTraces, xTraces[0], maxShift)
+	yAligned = ShiftTraces(yTraces, shifts)
+
+	return delay, xAligned.mean(axis=0), yAligned.mean(axis=0), shifts * step
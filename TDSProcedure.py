@@ -2,32 +2,22 @@
 # IMPORTS
 ####################################################################
 import XPSHelper as xpsHelp
+import Backends as backends
+from TDSAnalysis import GetFFTAbs, AlignTraces, ShiftTraces
+from ScanBuffer import ScanBuffer
 
 import logging
 log = logging.getLogger(__name__)
 log.addHandler(logging.NullHandler())
 
-import sys
-import tempfile
-from time import sleep
-from pymeasure.log import console_log
-from pymeasure.display.Qt import QtWidgets
-from pymeasure.display.windows import ManagedWindow
-# from pymeasure.display.windows.managed_dock_window import ManagedDockWindow
-from pymeasure.experiment import Procedure, Results
+from time import sleep, monotonic
+from pymeasure.experiment import Procedure, Metadata
 from pymeasure.experiment import BooleanParameter, IntegerParameter, FloatParameter, Parameter, ListParameter
-import matplotlib.pyplot as plt
-from newportxps import NewportXPS
 import numpy as np
 import shutil
 import os
-import win32ui
-from scipy.fft import fft, fftfreq
 import csv
 from datetime import datetime, timedelta
-from mcculw import ul
-from mcculw.enums import ULRange
-from mcculw.ul import ULError
 
 ####################################################################
 # GENERAL FUNCTIONS
@@ -35,18 +25,7 @@ from mcculw.ul import ULError
 
 def ChooseSaveFile():
 	# Choose file to save
-	dlg = win32ui.CreateFileDialog( 1, ".dat", "", 0, "Data Files (*.dat)|*.dat|All Files (*.*)|*.*|")
-	dlg.DoModal()
-	return dlg.GetPathName()
-
-def GetFFTAbs(x, y):
-	N = len(x)
-
-	fftFull = fft(y)
-	freq = fftfreq(N, x[1]-x[0])
-	fftAbs = 2.0/N * np.abs(fftFull)
-
-	return freq, fftAbs
+	return backends.CreateBackend('dialog', backends.DEFAULT_DIALOG)
 
 ####################################################################
 # THz Procedures
@@ -81,20 +60,43 @@ class TDSProcedure(Procedure):
 	
 	xps2Delay = FloatParameter('XPS 2 Delay', group_by='xps2Control', group_condition=True, units='ps', default=0)
 	
+	# DAQ Backend
+	daqBackend = ListParameter('DAQ Backend', choices=backends.GetBackendNames('daq'), group_by='scanType', group_condition=lambda v: v != 'Goto Delay', default='MCCDAQ')
+
 	# MCCDAQ
-	mccdacBoard = IntegerParameter('MCCDAQ Board Number', group_by='scanType', group_condition=lambda v: v != 'Goto Delay', default=0)
-	mccdacXChannel = IntegerParameter('MCCDAQ Lockin X Channel', group_by='scanType', group_condition=lambda v: v != 'Goto Delay', default=0)
-	mccdacYChannel = IntegerParameter('MCCDAQ Lockin Y Channel', group_by='scanType', group_condition=lambda v: v != 'Goto Delay', default=1)
+	mccdacBoard = IntegerParameter('MCCDAQ Board Number', group_by={'scanType': lambda v: v != 'Goto Delay', 'daqBackend': 'MCCDAQ'}, default=0)
+	mccdacXChannel = IntegerParameter('MCCDAQ Lockin X Channel', group_by={'scanType': lambda v: v != 'Goto Delay', 'daqBackend': 'MCCDAQ'}, default=0)
+	mccdacYChannel = IntegerParameter('MCCDAQ Lockin Y Channel', group_by={'scanType': lambda v: v != 'Goto Delay', 'daqBackend': 'MCCDAQ'}, default=1)
+
+	# SR830 Buffer
+	lockinResource = Parameter('Lockin Resource', group_by={'scanType': lambda v: v != 'Goto Delay', 'daqBackend': 'SR830 Buffer'}, default="GPIB0::8::INSTR")
+	lockinSampleRate = FloatParameter('Lockin Sample Rate', group_by={'scanType': lambda v: v != 'Goto Delay', 'daqBackend': 'SR830 Buffer'}, units='Hz', minimum=0.0625, maximum=512, default=64)
+	lockinBufferPoints = IntegerParameter('Lockin Buffer Points', group_by={'scanType': lambda v: v != 'Goto Delay', 'daqBackend': 'SR830 Buffer'}, minimum=1, maximum=16383, default=16)
 
-	# Lockin Info
-	dacWait = FloatParameter('Lockin wait time',  group_by='scanType', group_condition=lambda v: v != 'Goto Delay',  default=0.1,  units='s')
+	# Lockin Info (MCCDAQ only, digital backends read these back from the lockin)
+	dacWait = FloatParameter('Lockin wait time',  group_by={'scanType': lambda v: v != 'Goto Delay', 'daqBackend': 'MCCDAQ'},  default=0.1,  units='s')
 
-	lockinSen = FloatParameter('Lockin sensitivity',  group_by='scanType', group_condition=lambda v: v != 'Goto Delay',  default=500,  units='mV')
+	lockinSen = FloatParameter('Lockin sensitivity',  group_by={'scanType': lambda v: v != 'Goto Delay', 'daqBackend': 'MCCDAQ'},  default=500,  units='mV')
+
+	# Lockin settings used for the scan (read back from the lockin by digital DAQ backends)
+	# Evaluated after startup, so they are written to the results file header
+	lockinSenUsed = Metadata('Lockin sensitivity used', fget='sensitivity', units='mV')
+	lockinTCUsed = Metadata('Lockin time constant used', fget='timeConstant', units='s')
+
+	# Adaptive Dwell
+	adaptiveDwell = BooleanParameter('Adaptive Dwell', group_by='scanType', group_condition='Step Scan', default=False)
+	targetNoise = FloatParameter('Target Noise (0 = off)', group_by='adaptiveDwell', group_condition=True, units='mV', default=0.01)
+	targetSNR = FloatParameter('Target SNR (0 = off)', group_by='adaptiveDwell', group_condition=True, default=0)
+	maxDwell = FloatParameter('Max Dwell', group_by='adaptiveDwell', group_condition=True, units='s', default=2)
 
 	# Auto file naming
 	autoFileNameControl = BooleanParameter('Auto Name File', group_by='scanType', group_condition=lambda v: v != 'Goto Delay', default=False)
 	autoFileBaseName = Parameter('Auto Filename Base', group_by='autoFileNameControl', group_condition=True, default="TDSScan")
 
+	# Repeat alignment
+	alignRepeats = BooleanParameter('Align Repeats', group_by='autoFileNameControl', group_condition=True, default=False)
+	alignMaxShift = FloatParameter('Align Max Shift', group_by='alignRepeats', group_condition=True, units='ps', default=1.0)
+
 	# Save File Format 
 	outputFormat = ListParameter('Output Format', choices=['Josh File', 'pymeasure'], group_by='scanType', group_condition=lambda v: v != 'Goto Delay', default='Josh File')
 
@@ -104,27 +106,53 @@ class TDSProcedure(Procedure):
 
 
 	# Defines what data will be emitted for the main window
-	DATA_COLUMNS = ['Delay', 'X', 'Y', 'SigMon', 'Freq', 'FFT']
+	DATA_COLUMNS = ['Delay', 'X', 'Y', 'SigMon', 'Freq', 'FFT', 'XErr', 'YErr', 'Samples']
 
 	saveOnShutdown = False
 
+	# DAQ backend, created in 'startup'
+	daq = None
+
+	# Delay, reference X trace, sums of the aligned X/Y traces and number of repeats so far, keyed by
+	# the auto-named file path so other sequencer inputs (e.g. XPS 2 delay) get their own repeats
+	# Kept on the class so they are shared between the procedures of a sequence
+	repeatSums = {}
+
 	# Keeps track of when the measurement was started
 	startTime = None
 
 	def startup(self):
-		# Main dictionary to store data
-		self.data = {'Delay': [], 'X':[], 'Y':[], 'SigMon': [], 'Freq':[], 'FFT':[]}
+		# Main buffer to store data, sized from the scan plan (Read DAC grows it as needed)
+		if self.scanType == 'Step Scan':
+			self.data = ScanBuffer(len(self.getDelayPoints()))
+		else:
+			self.data = ScanBuffer(1024)
 
 		self.startTime = datetime.now()
-		self.dacRange = ULRange.BIP10VOLTS
+		self.alignedAvg = None
 		log.info("Startup")
 
+		# Lockin settings used for the scan, the parameters unless the DAQ backend reads them back
+		self.sensitivity = self.lockinSen
+		self.timeConstant = self.dacWait
+
+		if self.scanType != 'Goto Delay':
+			# Create the DAQ backend (hardware packages are imported here)
+			self.daq = backends.CreateBackend('daq', self.daqBackend, self)
+
+			self.sensitivity = self.daq.sensitivity
+
+			if self.daq.timeConstant is not None:
+				self.timeConstant = self.daq.timeConstant
+
+			log.info("Lockin sensitivity = {} mV, time constant = {} s".format(self.sensitivity, self.timeConstant))
+
 		if self.scanType != 'Read DAC':
 			# Try and connect to XPS
 			try:
 				if self.xps == None:
 					log.info("Connecting to XPS")
-					self.xps = xpsHelp.InitXPS(self.xpsIP)
+					self.xps = backends.CreateBackend('motion', backends.DEFAULT_MOTION, self.xpsIP)
 				else:
 					log.info("XPS already connected")
 
@@ -157,20 +185,17 @@ class TDSProcedure(Procedure):
 				break
 
 			# Wait 2 time constants
-			waitTime = self.dacWait * 2
+			waitTime = self.timeConstant * 2
 
-			self.data['Delay'].append(counter * waitTime)
+			# Take measurement from DAQ (in lockin mV)
+			x, y = self.daq.Read()
 
-			# Take measurement from DAC
-			# NOTE: May need to convert to enginerring units to get voltage
-			self.data['X'].append(self.lockinSen * ul.to_eng_units(self.mccdacBoard, self.dacRange, ul.a_in(self.mccdacBoard, self.mccdacXChannel, self.dacRange)) / 10) # Convert to mV
-			self.data['Y'].append(self.lockinSen * ul.to_eng_units(self.mccdacBoard, self.dacRange, ul.a_in(self.mccdacBoard, self.mccdacYChannel, self.dacRange)) / 10) # Convert to mV
+			curData = {'Delay': counter * waitTime, 'X': x, 'Y': y}
+			self.data.Append(curData)
 
 			# Wait
 			sleep(waitTime)
 
-			curData = {'Delay': self.data["Delay"][counter], 'X': self.data["X"][counter], 'Y': self.data["Y"][counter]}
-
 			# Emit data
 			self.emit('results', curData)
 
@@ -206,10 +231,10 @@ class TDSProcedure(Procedure):
 			return
 
 		# Create array of delay points
-		delayPoints = np.arange(self.startDelay, self.stopDelay, self.stepDelay)
+		delayPoints = self.getDelayPoints()
 
 		# Get the lockin time constant
-		tc = self.dacWait
+		tc = self.timeConstant
 
 		# Set wait time between measurements (tc * 2)
 		waitTime = tc * 2
@@ -227,17 +252,13 @@ class TDSProcedure(Procedure):
 			# Move to delay
 			self.xps.move_stage(self.xpsStage, xpsHelp.ConvertPsToMm(delay, self.xpsZeroOffset, self.xpsPasses, self.xpsReverse))
 
-			self.data['Delay'].append(delay)
-
 			# Wait 2 time constants
 			sleep(waitTime)
 
-			# Take measurement from DAC
-			self.data['X'].append(self.lockinSen * ul.to_eng_units(self.mccdacBoard, self.dacRange, ul.a_in(self.mccdacBoard, self.mccdacXChannel, self.dacRange)) / 10) # Convert to lockin mV
-			self.data['Y'].append(self.lockinSen * ul.to_eng_units(self.mccdacBoard, self.dacRange, ul.a_in(self.mccdacBoard, self.mccdacYChannel, self.dacRange)) / 10) # Convert to mV
-
-
-			curData = {'Delay': self.data["Delay"][counter], 'X': self.data["X"][counter], 'Y': self.data["Y"][counter]}
+			# Take measurement from DAQ (in lockin mV)
+			curData = self.acquirePoint()
+			curData['Delay'] = delay
+			self.data.Append(curData)
 
 			# Emit data
 			self.emit('results', curData)
@@ -247,12 +268,73 @@ class TDSProcedure(Procedure):
 
 			counter += 1
 
+	def getDelayPoints(self):
+		# Delay points of the step scan
+		return np.arange(self.startDelay, self.stopDelay, self.stepDelay)
+
+	def acquirePoint(self):
+		# Fixed dwell, single reading from the DAQ
+		if not self.adaptiveDwell:
+			x, y = self.daq.Read()
+			return {'X': x, 'Y': y}
+
+		# Adaptive dwell, keep averaging until the noise/SNR target or the max dwell is reached
+		# Samples within 2 time constants are correlated by the lockin filter, so the batches start
+		# at least 2 time constants apart and each batch mean counts as one independent sample
+		batchTime = self.timeConstant * 2
+		batchPoints = max(1, int(round(batchTime / self.daq.sampleTime)))
+
+		# Don't ask for more samples than the DAQ can read at once (the batches are still spaced by 'batchTime')
+		if self.daq.maxSamples is not None:
+			batchPoints = min(batchPoints, self.daq.maxSamples)
+
+		xMeans = []
+		yMeans = []
+		xErr = np.nan
+		yErr = np.nan
+		startTime = monotonic()
+
+		while True:
+			batchStart = monotonic()
+
+			x, y = self.daq.ReadSamples(batchPoints)
+			xMeans.append(np.mean(x))
+			yMeans.append(np.mean(y))
+
+			n = len(xMeans)
+
+			if n >= 2:
+				# Standard error of the mean
+				xErr = np.std(xMeans, ddof=1) / np.sqrt(n)
+				yErr = np.std(yMeans, ddof=1) / np.sqrt(n)
+
+				if self.targetNoise > 0 and xErr <= self.targetNoise:
+					break
+
+				if self.targetSNR > 0 and abs(np.mean(xMeans)) >= self.targetSNR * xErr:
+					break
+
+			if monotonic() - startTime >= self.maxDwell or self.should_stop():
+				break
+
+			# Wait for the rest of the batch time if reading the batch took less
+			remaining = batchTime - (monotonic() - batchStart)
+
+			if remaining > 0:
+				sleep(remaining)
+
+		return {'X': np.mean(xMeans), 'Y': np.mean(yMeans), 'XErr': xErr, 'YErr': yErr, 'Samples': n * batchPoints}
+
 	def execute(self):
 		if self.scanType == 'Step Scan':
 			self.saveOnShutdown = True
 			self.executeStepScan()
 			self.emitFFT()
 
+			# Don't align incomplete scans
+			if self.alignRepeats and not self.should_stop():
+				self.alignRepeat()
+
 		elif self.scanType == 'Goto Delay':
 			self.executeGotoDelay()
 
@@ -281,14 +363,50 @@ class TDSProcedure(Procedure):
 		# FFT the data stored in 'self.data'
 		freq, fftX = GetFFTAbs(self.data['Delay'], self.data['X'])
 
-		# Store the FFT to the data dictionary
+		# Store the FFT to the data buffer
 		self.data['Freq'] = freq
 		self.data['FFT'] = fftX
 
-		# Emit the FFT data
-		for i in range(len(freq)):
-			curData = {'Freq': freq[i], 'FFT': fftX[i]}
-			self.emit('results', curData)
+		# Emit the FFT data in one batch
+		self.emit('batch results', {'Freq': self.data['Freq'], 'FFT': self.data['FFT']})
+
+	def alignRepeat(self):
+		key = self.getAutoFilePath()
+		sums = TDSProcedure.repeatSums.get(key)
+
+		# Start a new set of repeats on the first repeat or if the delay points have changed
+		# The first repeat is the reference the others are aligned to
+		if self.repeat <= 1 or sums is None or not np.array_equal(sums['Delay'], self.data['Delay']):
+			# Copy the traces as the buffer belongs to this procedure
+			sums = {'Delay': self.data['Delay'].copy(), 'Reference': self.data['X'].copy(), 'X': self.data['X'].copy(), 'Y': self.data['Y'].copy(), 'Repeats': 1}
+			TDSProcedure.repeatSums[key] = sums
+			shift = 0.0
+		else:
+			# Align this repeat's X trace to the reference and apply the same shift to Y
+			xAligned, shifts = AlignTraces(self.data['X'], sums['Reference'], self.alignMaxShift / self.stepDelay)
+			yAligned = ShiftTraces(self.data['Y'], shifts)
+
+			sums['X'] += xAligned[0]
+			sums['Y'] += yAligned[0]
+			sums['Repeats'] += 1
+			shift = shifts[0]
+
+		log.info("Repeat {} shift = {:.4f} ps".format(sums['Repeats'], shift * self.stepDelay))
+
+		self.alignedAvg = {'Delay': sums['Delay'], 'X': sums['X'] / sums['Repeats'], 'Y': sums['Y'] / sums['Repeats'], 'Repeats': sums['Repeats']}
+
+	def alignedSave(self, savepath):
+		# Save the aligned average of the repeats
+		with open(savepath, 'w') as datFile:
+			writer = csv.writer(datFile, delimiter='\t', lineterminator='\n')
+
+			# Write headers
+			writer.writerow(['Delay', 'X', 'Y', 'Repeats']) # Headers
+			writer.writerow(['ps', 'mV', 'mV', '']) # Units
+
+			# Write data
+			for i in range(len(self.alignedAvg['Delay'])):
+				writer.writerow([str(self.alignedAvg['Delay'][i]), str(self.alignedAvg['X'][i]), str(self.alignedAvg['Y'][i]), str(self.alignedAvg['Repeats'])])
 
 	def pymeasureSave(self, savepath):
 		# Copy the current temp file to the savepath
@@ -300,31 +418,11 @@ class TDSProcedure(Procedure):
 			writer = csv.writer(datFile, delimiter='\t', lineterminator='\n')
 			
 			# Write headers
-			writer.writerow(['Delay', 'X', 'Y', 'FFT Freq', 'FFT', 'SigMon']) # Headers
-			writer.writerow(['ps', 'mV', 'mV', 'THz', 'amp', 'V']) # Units
-
-			# Write data
-			for i in range(len(self.data['Delay'])):
-				curDelay = str(self.data['Delay'][i])
-				curX = str(self.data['X'][i])
-				curY = str(self.data['Y'][i])
-
-				try:
-					curFreq = str(self.data['Freq'][i])
-				except:
-					curFreq = "NaN"
+			writer.writerow(['Delay', 'X', 'Y', 'FFT Freq', 'FFT', 'SigMon', 'X Err', 'Y Err', 'Samples']) # Headers
+			writer.writerow(['ps', 'mV', 'mV', 'THz', 'amp', 'V', 'mV', 'mV', '']) # Units
 
-				try:
-					curFFT = str(self.data['FFT'][i])
-				except:
-					curFFT = "NaN"
-
-				try:
-					curSigMon = str(self.data['SigMon'][i])
-				except:
-					curSigMon = "NaN"
-
-				writer.writerow([curDelay, curX, curY, curFreq, curFFT, curSigMon])
+			# Write data (unmeasured values are NaN)
+			self.data.Write(datFile, ['Delay', 'X', 'Y', 'Freq', 'FFT', 'SigMon', 'XErr', 'YErr', 'Samples'], intColumns=['Samples'])
 
 
 		# Save pymeasure file to settings folder
@@ -342,6 +440,20 @@ class TDSProcedure(Procedure):
 		self.pymeasureSave(settingsSavepath)
 
 		
+	def getAutoFilePath(self):
+		# Full path of the auto-named file, without the extension
+		autoNameBase = self.autoFileBaseName
+
+		if autoNameBase == " ":
+			autoNameBase = ""
+
+		# Add to the base auto file name if instrument control has been selected
+		# XPS 2
+		if self.xps2Control:
+			autoNameBase = "{}_delay={}ps".format(autoNameBase, self.xps2Delay)
+
+		return os.path.join(self.defaultDir, autoNameBase)
+
 	def trySaveFile(self):
 		# Checks if the flag 'saveOnShutdown' is enabled
 		# This flag should be set if needed for the given scan type in 'execute()'
@@ -350,18 +462,8 @@ class TDSProcedure(Procedure):
 			if self.autoFileNameControl:
 				fileCount = 1
 
-				autoNameBase = self.autoFileBaseName
-
-				if autoNameBase == " ":
-					autoNameBase = ""
-
-				# Add to the base auto file name if instrument control has been selected
-				# XPS 2
-				if self.xps2Control:
-					autoNameBase = "{}_delay={}ps".format(autoNameBase, self.xps2Delay)
-
 				# Get the full path of the auto-named file
-				autoFilePath = os.path.join(self.defaultDir, autoNameBase)
+				autoFilePath = self.getAutoFilePath()
 
 				curSavePath = autoFilePath + ".dat"
 
@@ -373,6 +475,11 @@ class TDSProcedure(Procedure):
 
 				# Build the complete filepath
 				savepath = curSavePath
+
+				# Save the aligned average of the repeats so far
+				if self.alignRepeats and self.alignedAvg is not None:
+					log.info("Saving aligned average to " + autoFilePath + "_aligned_avg.dat")
+					self.alignedSave(autoFilePath + "_aligned_avg.dat")
 			else:
 				# Bring up a save dialog
 				savepath = ChooseSaveFile()
@@ -395,7 +502,13 @@ class TDSProcedure(Procedure):
 		curStartTime = datetime.now()
 
 		if self.scanType == 'Step Scan':
-			duration = ((self.stopDelay - self.startDelay) / self.stepDelay) * self.dacWait * 2.0
+			if self.adaptiveDwell:
+				# Worst case, every point reaches the max dwell
+				pointTime = self.timeConstant * 2.0 + self.maxDwell
+			else:
+				pointTime = self.timeConstant * 2.0 + self.daq.readTime
+
+			duration = ((self.stopDelay - self.startDelay) / self.stepDelay) * pointTime
 
 
 		elif self.scanType == 'Goto Delay' or self.scanType == 'Read DAC':
@@ -412,4 +525,14 @@ class TDSProcedure(Procedure):
 	def shutdown(self):
 		self.trySaveFile()
 		self.xps = None
+
+		# Release the DAQ so the next procedure in a sequence can open it
+		if self.daq is not None:
+			try:
+				self.daq.Close()
+			except Exception as e:
+				log.error("DAQ close failed")
+				log.error(str(e))
+
+			self.daq = None
 	
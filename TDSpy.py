@@ -2,11 +2,12 @@
 # PACKAGES REQUIRED
 ####################################################################
 
-# pymeasure
-# newportxps
-# matplotlib
+# pymeasure (0.14 or newer)
+# newportxps (Newport XPS backend)
+# numpy
 # PyQt5
-# pywin32
+# mcculw (MCCDAQ backend)
+# pywin32 (Windows save dialog)
 # scipy
 
 ####################################################################
@@ -16,19 +17,16 @@ import logging
 log = logging.getLogger(__name__)
 log.addHandler(logging.NullHandler())
 
-import XPSHelper as xpsHelp
+import Backends as backends
 import TDSProcedure as tdsProc
-from pymeasure.log import console_log
 from pymeasure.display.Qt import QtWidgets
 from pymeasure.display.windows import ManagedWindow
 # from pymeasure.display.windows.managed_dock_window import ManagedDockWindow
-from pymeasure.experiment import Procedure, Results
-from pymeasure.experiment import BooleanParameter, IntegerParameter, FloatParameter, Parameter, ListParameter
+from pymeasure.experiment import Results
 import tempfile
 import sys
 import shutil
 import os
-from pymeasure.log import console_log
 
 ####################################################################
 # Main Window
@@ -39,8 +37,8 @@ class TDSWindow(ManagedWindow):
 	def __init__(self):
 		super().__init__(
 			procedure_class=tdsProc.TDSProcedure,
-			inputs=['scanType','startDelay','stepDelay','stopDelay', 'gotoDelay', 'thzBandwidth','xpsIP','xpsStage','xpsPasses','xpsZeroOffset','xpsReverse', 'xps2Control', 'xps2Stage', 'xps2Passes', 'xps2ZeroOffset', 'xps2Reverse', 'xps2Delay', 'mccdacBoard','mccdacXChannel','mccdacYChannel','dacWait', 'lockinSen', 'autoFileNameControl', 'autoFileBaseName', 'outputFormat', 'repeat'],
-			displays=['scanType','startDelay','stepDelay','stopDelay', 'gotoDelay', 'thzBandwidth','xpsIP','xpsStage','xpsPasses','xpsZeroOffset','xpsReverse', 'xps2Control', 'xps2Stage', 'xps2Passes', 'xps2ZeroOffset', 'xps2Reverse', 'xps2Delay','mccdacBoard','mccdacXChannel','mccdacYChannel','dacWait', 'lockinSen' ],
+			inputs=['scanType','startDelay','stepDelay','stopDelay', 'gotoDelay', 'thzBandwidth','xpsIP','xpsStage','xpsPasses','xpsZeroOffset','xpsReverse', 'xps2Control', 'xps2Stage', 'xps2Passes', 'xps2ZeroOffset', 'xps2Reverse', 'xps2Delay', 'daqBackend', 'mccdacBoard','mccdacXChannel','mccdacYChannel', 'lockinResource', 'lockinSampleRate', 'lockinBufferPoints','dacWait', 'lockinSen', 'adaptiveDwell', 'targetNoise', 'targetSNR', 'maxDwell', 'autoFileNameControl', 'autoFileBaseName', 'alignRepeats', 'alignMaxShift', 'outputFormat', 'repeat'],
+			displays=['scanType','startDelay','stepDelay','stopDelay', 'gotoDelay', 'thzBandwidth','xpsIP','xpsStage','xpsPasses','xpsZeroOffset','xpsReverse', 'xps2Control', 'xps2Stage', 'xps2Passes', 'xps2ZeroOffset', 'xps2Reverse', 'xps2Delay', 'daqBackend','mccdacBoard','mccdacXChannel','mccdacYChannel', 'lockinResource', 'lockinSampleRate', 'lockinBufferPoints','dacWait', 'lockinSen', 'adaptiveDwell', 'targetNoise', 'targetSNR', 'maxDwell' ],
 			x_axis='Delay',
 			y_axis='X',
 			sequencer=True,
@@ -69,7 +67,7 @@ class TDSWindow(ManagedWindow):
 		# Connect to XPS if unconnected
 		if self.xps == None:
 			try:
-				self.xps = xpsHelp.InitXPS(self.inputs.xpsIP.parameter.value)
+				self.xps = backends.CreateBackend('motion', backends.DEFAULT_MOTION, self.inputs.xpsIP.parameter.value)
 			except:
 				log.warning("Could not perform initial XPS connection")
 
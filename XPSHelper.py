@@ -2,7 +2,6 @@
 # IMPORTS
 ####################################################################
 import os
-from newportxps import NewportXPS
 import math
 import csv
 import numpy as np
@@ -39,6 +38,9 @@ def GetBandwidthStageSpeed(bandwidth, tc, tcToWait, passes):
 ####################################################################
 
 def InitXPS(ip, user = "Administrator", password = "Administrator"):
+	# newportxps is imported here so the unit and gathering functions can be used without it
+	from newportxps import NewportXPS
+
 	# 'known_hosts' filepath
 	kfFilepath = "{}\\.ssh\\known_hosts.".format(os.path.expanduser('~'))
 
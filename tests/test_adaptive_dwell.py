@@ -0,0 +1,88 @@
+from itertools import cycle
+
+import numpy as np
+import pytest
+
+from TDSProcedure import TDSProcedure
+
+
+class FakeDAQ:
+	# Returns batches filled with the next of 'values' (mV) for X, and half of it for Y
+	def __init__(self, values, sampleTime=0.0005, maxSamples=None):
+		self.values = cycle(values)
+		self.sampleTime = sampleTime
+		self.timeConstant = None
+		self.maxSamples = maxSamples
+		self.requests = []
+
+	def Read(self):
+		value = next(self.values)
+		return value, value / 2
+
+	def ReadSamples(self, n):
+		self.requests.append(n)
+		value = next(self.values)
+		return np.full(n, value), np.full(n, value / 2)
+
+
+def make_procedure(daq, targetNoise=0.0, targetSNR=0.0, maxDwell=10.0):
+	procedure = TDSProcedure(adaptiveDwell=True, targetNoise=targetNoise, targetSNR=targetSNR, maxDwell=maxDwell)
+	procedure.daq = daq
+
+	# Normally patched in by the pymeasure worker
+	procedure.should_stop = lambda: False
+
+	# Batches of 2 ms, 4 samples each
+	procedure.timeConstant = 0.001
+
+	return procedure
+
+
+def test_stops_on_target_noise():
+	daq = FakeDAQ([1.01, 0.99])
+	point = make_procedure(daq, targetNoise=0.05).acquirePoint()
+
+	# Two batches give an error of 0.01 mV
+	assert len(daq.requests) == 2
+	assert point['X'] == pytest.approx(1.0)
+	assert point['XErr'] == pytest.approx(0.01)
+	assert point['YErr'] == pytest.approx(0.005)
+
+
+def test_stops_on_target_snr_only():
+	daq = FakeDAQ([1.2, 0.8])
+	point = make_procedure(daq, targetNoise=0, targetSNR=10).acquirePoint()
+
+	n = len(daq.requests)
+	assert abs(point['X']) >= 10 * point['XErr']
+
+	# One batch fewer wouldn't have met the target
+	means = [1.2, 0.8] * n
+	previousErr = np.std(means[:n - 1], ddof=1) / np.sqrt(n - 1)
+	assert abs(np.mean(means[:n - 1])) < 10 * previousErr
+
+
+def test_max_dwell_with_one_batch():
+	daq = FakeDAQ([1.0, 2.0])
+	point = make_procedure(daq, targetNoise=0.05, maxDwell=0).acquirePoint()
+
+	assert len(daq.requests) == 1
+	assert point['X'] == 1.0
+	assert np.isnan(point['XErr'])
+	assert np.isnan(point['YErr'])
+
+
+def test_samples_count():
+	daq = FakeDAQ([1.01, 0.99])
+	point = make_procedure(daq, targetNoise=0.05).acquirePoint()
+
+	assert daq.requests == [4, 4]
+	assert point['Samples'] == 2 * 4
+
+
+def test_batch_limited_to_daq():
+	daq = FakeDAQ([1.01, 0.99], maxSamples=3)
+	point = make_procedure(daq, targetNoise=0.05).acquirePoint()
+
+	assert daq.requests == [3, 3]
+	assert point['Samples'] == 2 * 3
@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+import TDSAnalysis as analysis
+
+STEP = 0.05 # ps
+DELAY = np.arange(0, 20, STEP)
+
+
+def pulse(shift):
+	# Single cycle THz-like pulse, 'shift' in samples
+	t = DELAY - 8 - shift * STEP
+	return np.exp(-(t / 0.3) ** 2) * np.sin(2 * np.pi * t)
+
+
+def test_sub_sample_shifts():
+	trueShifts = np.array([0, 5.2, -3.7, 0.4])
+	traces = np.array([pulse(shift) for shift in trueShifts])
+
+	shifts = analysis.GetTraceShifts(traces, traces[0])
+
+	assert shifts == pytest.approx(trueShifts, abs=0.05)
+
+
+def test_align_and_average():
+	rng = np.random.default_rng(0)
+	trueShifts = rng.uniform(-8, 8, 500)
+	traces = np.array([pulse(shift) for shift in trueShifts])
+
+	average, shifts = analysis.AlignAndAverage(traces, traces[0])
+
+	assert shifts == pytest.approx(trueShifts - trueShifts[0], abs=0.05)
+	assert average == pytest.approx(pulse(trueShifts[0]), abs=1e-3)
+
+
+def test_max_shift_limits_shift():
+	traces = np.array([pulse(0), pulse(5.2), pulse(10)])
+
+	shifts = analysis.GetTraceShifts(traces, traces[0], maxShift=3)
+
+	assert np.all(np.abs(shifts) <= 3)
+	assert shifts[0] == pytest.approx(0, abs=0.05)
+
+
+def test_max_shift_below_one_sample():
+	traces = np.array([pulse(shift) for shift in [0, 1.3, -2.9, 7.0, -30]])
+
+	shifts = analysis.GetTraceShifts(traces, traces[0], maxShift=0.5)
+
+	# Only a zero lag fits in the window
+	assert np.all(shifts == 0)
+
+
+def test_align_josh_files(tmp_path):
+	filepaths = []
+
+	for i, shift in enumerate([0, 4.5, -2.5]):
+		filepath = tmp_path / "scan_{}.dat".format(i)
+		columns = np.column_stack([DELAY, pulse(shift), pulse(shift) / 2])
+		header = "Delay\tX\tY\nps\tmV\tmV"
+		np.savetxt(filepath, columns, delimiter='\t', header=header, comments='')
+		filepaths.append(filepath)
+
+	delay, x, y, shifts = analysis.AlignJoshFiles(filepaths, maxShift=0.5)
+
+	# Shifts and 'maxShift' are in ps
+	assert shifts == pytest.approx([0, 4.5 * STEP, -2.5 * STEP], abs=0.005)
+	assert x == pytest.approx(pulse(0), abs=1e-3)
+	assert y == pytest.approx(pulse(0) / 2, abs=1e-3)
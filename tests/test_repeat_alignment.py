@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+import TDSAnalysis as analysis
+from ScanBuffer import ScanBuffer
+from TDSProcedure import TDSProcedure
+
+STEP = 0.05 # ps
+DELAY = np.arange(0, 20, STEP)
+
+
+def pulse(shift):
+	# Single cycle THz-like pulse, 'shift' in samples
+	t = DELAY - 8 - shift * STEP
+	return np.exp(-(t / 0.3) ** 2) * np.sin(2 * np.pi * t)
+
+
+@pytest.fixture(autouse=True)
+def clear_repeats():
+	TDSProcedure.repeatSums = {}
+	yield
+	TDSProcedure.repeatSums = {}
+
+
+def run_repeat(tmp_path, repeat, shift, xps2Delay=0.0):
+	procedure = TDSProcedure(repeat=repeat, stepDelay=STEP, alignRepeats=True, alignMaxShift=1.0, autoFileNameControl=True, autoFileBaseName="Scan", xps2Control=True, xps2Delay=xps2Delay)
+	procedure.setDefaultDir(str(tmp_path))
+
+	procedure.data = ScanBuffer(len(DELAY))
+
+	for delay, x in zip(DELAY, pulse(shift)):
+		procedure.data.Append({'Delay': delay, 'X': x, 'Y': x / 2})
+
+	procedure.alignRepeat()
+
+	savepath = procedure.getAutoFilePath() + "_aligned_avg.dat"
+	procedure.alignedSave(savepath)
+
+	return analysis.ReadJoshFile(savepath)
+
+
+def test_repeats_are_aligned_and_averaged(tmp_path):
+	for repeat, shift in enumerate([0, 3.5, -2.2, 6.1], start=1):
+		saved = run_repeat(tmp_path, repeat, shift)
+
+	assert saved['Repeats'][0] == 4
+	assert saved['Delay'] == pytest.approx(DELAY)
+	assert saved['X'] == pytest.approx(pulse(0), abs=1e-3)
+	assert saved['Y'] == pytest.approx(pulse(0) / 2, abs=1e-3)
+
+	# Only the reference and running sums are kept
+	sums = list(TDSProcedure.repeatSums.values())[0]
+	assert sums['Reference'] == pytest.approx(pulse(0))
+
+
+def test_first_repeat_starts_new_set(tmp_path):
+	run_repeat(tmp_path, 1, 0)
+	run_repeat(tmp_path, 2, 3)
+	saved = run_repeat(tmp_path, 1, 4)
+
+	assert saved['Repeats'][0] == 1
+	assert saved['X'] == pytest.approx(pulse(4))
+
+
+def test_xps2_delays_averaged_separately(tmp_path):
+	# Repeat is the outer loop of the sequence, XPS 2 delay the inner loop
+	for repeat in [1, 2, 3]:
+		savedA = run_repeat(tmp_path, repeat, 2 * repeat, xps2Delay=1.0)
+		savedB = run_repeat(tmp_path, repeat, -repeat, xps2Delay=2.0)
+
+	assert len(TDSProcedure.repeatSums) == 2
+	assert savedA['Repeats'][0] == 3
+	assert savedB['Repeats'][0] == 3
+
+	# Each delay is aligned to its own first repeat
+	assert savedA['X'] == pytest.approx(pulse(2), abs=1e-3)
+	assert savedB['X'] == pytest.approx(pulse(-1), abs=1e-3)
@@ -0,0 +1,70 @@
+import io
+
+import numpy as np
+
+from ScanBuffer import ScanBuffer
+
+COLUMNS = ['Delay', 'X', 'Y', 'Freq', 'FFT', 'SigMon', 'XErr', 'YErr', 'Samples']
+
+
+def write_rows(buffer, columns, intColumns):
+	# Row by row writer the vectorised 'Write' replaced
+	lines = []
+
+	for row in buffer.array[columns][:buffer.count]:
+		values = []
+
+		for column, value in zip(columns, row):
+			if np.isnan(value):
+				values.append("NaN")
+			elif column in intColumns:
+				values.append(str(int(value)))
+			else:
+				values.append(str(float(value)))
+
+		lines.append("\t".join(values) + "\n")
+
+	return "".join(lines)
+
+
+def test_append_grows_and_returns_views():
+	buffer = ScanBuffer(2)
+
+	for i in range(5):
+		buffer.Append({'Delay': i * 0.1, 'X': i, 'Y': -i})
+
+	assert len(buffer) == 5
+	assert buffer['X'].tolist() == [0, 1, 2, 3, 4]
+	assert np.shares_memory(buffer['X'], buffer.array)
+	assert np.all(np.isnan(buffer['SigMon']))
+
+
+def test_write_keeps_josh_format():
+	buffer = ScanBuffer(4)
+	buffer.Append({'Delay': 0.1, 'X': 1.5, 'Y': 2, 'Samples': 32})
+	buffer.Append({'Delay': 0.2, 'X': -1, 'Y': 0})
+
+	datFile = io.StringIO()
+	buffer.Write(datFile, ['Delay', 'X', 'Y', 'SigMon', 'Samples'], intColumns=['Samples'])
+
+	assert datFile.getvalue() == "0.1\t1.5\t2.0\tNaN\t32\n0.2\t-1.0\t0.0\tNaN\tNaN\n"
+
+
+def test_write_matches_row_writer():
+	rng = np.random.default_rng(0)
+	buffer = ScanBuffer(10)
+
+	for i in range(250):
+		buffer.Append({'Delay': i * 0.01, 'X': rng.normal() * 10.0 ** rng.integers(-8, 8), 'Y': -0.0, 'FFT': 1e20, 'XErr': rng.choice([np.nan, 0.5]), 'Samples': rng.choice([np.nan, 16, 32768])})
+
+	datFile = io.StringIO()
+	buffer.Write(datFile, COLUMNS, intColumns=['Samples'], chunkRows=64)
+
+	assert datFile.getvalue() == write_rows(buffer, COLUMNS, ['Samples'])
+
+
+def test_write_empty():
+	datFile = io.StringIO()
+	ScanBuffer(4).Write(datFile, COLUMNS)
+
+	assert datFile.getvalue() == ""
@@ -0,0 +1,105 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from pymeasure.adapters import ProtocolAdapter
+
+import Backends as backends
+
+# Lockin state read at startup: X/Y displays, 1 Hz, loop mode
+SAVE_SETTINGS = [("DDEF? 1", "1,0"), ("DDEF? 2", "1,0"), ("SRAT?", "4"), ("SEND?", "1")]
+
+# Read back 500 mV sensitivity and 100 ms time constant
+READ_SETTINGS = [("SENS?", "25"), ("OFLT?", "8")]
+
+
+def make_procedure(adapter, sampleRate=64, bufferPoints=3, stop=False):
+	return SimpleNamespace(lockinResource=adapter, lockinSampleRate=sampleRate, lockinBufferPoints=bufferPoints, should_stop=lambda: stop)
+
+
+def setup_pairs(rateIndex):
+	return SAVE_SETTINGS + [("DDEF 1,0,0", None), ("DDEF 2,0,0", None), ("SRAT {}".format(rateIndex), None), ("SEND 0", None)] + READ_SETTINGS
+
+
+def test_reads_back_settings():
+	adapter = ProtocolAdapter(setup_pairs(10))
+	daq = backends.SR830Buffer(make_procedure(adapter))
+
+	assert daq.sensitivity == pytest.approx(500)
+	assert daq.timeConstant == pytest.approx(0.1)
+	assert daq.sampleRate == 64
+	assert daq.readTime == pytest.approx(3 / 64)
+
+
+@pytest.mark.parametrize("sampleRate, rateIndex", [(64, 10), (100, 11), (0.01, 0), (1000, 13)])
+def test_sample_rate_selection(sampleRate, rateIndex):
+	adapter = ProtocolAdapter(setup_pairs(rateIndex))
+	daq = backends.SR830Buffer(make_procedure(adapter, sampleRate))
+
+	assert daq.rateIndex == rateIndex
+
+
+@pytest.mark.parametrize("sampleRate", [0, -64])
+def test_invalid_sample_rate(sampleRate):
+	with pytest.raises(ValueError):
+		backends.SR830Buffer(make_procedure(ProtocolAdapter(), sampleRate))
+
+
+def test_read_binary_buffer():
+	x = np.array([0.001, -0.002, 0.0035], dtype='<f4')
+	y = np.array([0.0, 0.25, -0.5], dtype='<f4')
+
+	# The buffer is still filling on the first SPTS? poll
+	readPairs = [("REST", None), ("STRT", None), ("SPTS?", "2"), ("SPTS?", "3"), ("PAUS", None),
+		("TRCB? 1,0,3", None), (None, x.tobytes()), ("TRCB? 2,0,3", None), (None, y.tobytes())]
+	adapter = ProtocolAdapter(setup_pairs(10) + readPairs)
+	daq = backends.SR830Buffer(make_procedure(adapter))
+
+	xRead, yRead = daq.Read()
+
+	assert xRead == pytest.approx(np.mean(x.astype(float)) * 1000)
+	assert yRead == pytest.approx(np.mean(y.astype(float)) * 1000)
+
+
+def test_close_restores_settings():
+	restorePairs = [("DDEF 1,1,0", None), ("DDEF 2,1,0", None), ("SRAT 4", None), ("SEND 1", None)]
+	adapter = ProtocolAdapter(setup_pairs(10) + restorePairs)
+	daq = backends.SR830Buffer(make_procedure(adapter))
+
+	daq.Close()
+
+	assert adapter._index == len(adapter.comm_pairs)
+
+
+def test_oversize_read_raises():
+	# Nothing is sent to the lockin after setup
+	adapter = ProtocolAdapter(setup_pairs(10))
+	daq = backends.SR830Buffer(make_procedure(adapter))
+
+	with pytest.raises(ValueError):
+		daq.ReadSamples(backends.SR830Buffer.MAX_BUFFER_POINTS + 1)
+
+	assert adapter._index == len(adapter.comm_pairs)
+
+
+def test_buffer_fill_timeout():
+	daq = backends.SR830Buffer(make_procedure(ProtocolAdapter(setup_pairs(10))))
+
+	# Lockin that never stores any points
+	daq.lockin = SimpleNamespace(write=lambda command: None, ask=lambda command: "0")
+
+	with pytest.raises(TimeoutError):
+		daq.ReadSamples(3)
+
+
+def test_stop_while_filling():
+	readPairs = [("REST", None), ("STRT", None), ("SPTS?", "1"), ("PAUS", None),
+		("TRCB? 1,0,1", None), (None, np.array([0.001], dtype='<f4').tobytes()), ("TRCB? 2,0,1", None), (None, np.array([0.002], dtype='<f4').tobytes())]
+	adapter = ProtocolAdapter(setup_pairs(10) + readPairs)
+	daq = backends.SR830Buffer(make_procedure(adapter, stop=True))
+
+	x, y = daq.ReadSamples(3)
+
+	# Only the stored point is read
+	assert x == pytest.approx([1])
+	assert y == pytest.approx([2])